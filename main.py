@@ -3,7 +3,8 @@ import os
 import asyncio
 import sys
 import json
-from time import time, mktime
+from time import time
+from calendar import timegm
 import ciso8601 as datetime
 from time import sleep
 import aiofiles
@@ -17,6 +18,21 @@ if sys.platform == "win32":
 with open("config.json") as config:
     config = json.load(config)
 
+# default any settings missing from older config files to the shipped values
+config.setdefault("download_order", "newest")
+config.setdefault("concurrent_listings", 8)
+config.setdefault("post_process_downloads", False)
+config.setdefault("post_process_workers", 2)
+config.setdefault("post_process_queue_size", 256)
+config.setdefault("write_xmp_sidecars", False)
+
+# validate the download order now, rather than on the first download lapse
+if config["download_order"] not in utils.scheduler.download_queue.policies:
+    raise ValueError(
+        "download_order must be one of "
+        + ", ".join(utils.scheduler.download_queue.policies)
+    )
+
 # if first run, an auth file will need to be created
 if "auth.json" not in os.listdir("utils"):
     with open("utils/auth.json", "w") as auth:
@@ -121,46 +137,76 @@ async def download_library(client, data: dict) -> dict:
     )
 
     async def current_download_data(data):
-        """Yields current baseurl for photo to download."""
-        for media, media_data in data["media"].items():
-            # if flagged as not yet downloaded
-            if not media_data["downloaded"]:
-                # if the media base_url is expired generate a new one
-                if media_data["last_checked_at"] > time() + 50 * 60:
-                    media_data = await client.request(
-                        "mediaItems/" + media, "photoslibrary.readonly"
-                    )
-                # yield the data
-                yield media, media_data
-
-    download_tasks = []
-    async for media, media_data in current_download_data(data):
-        progress_tracker.next()
-
-        if "video" in media_data["type"]:
-            media_data["url"] += "=dv"
-        else:
-            media_data["url"] += "=d"
-
-        download_tasks.append(
-            asyncio.ensure_future(
-                client.download_file(
-                    media_data["filename"],
-                    media_data["url"],
-                    download_path="output/media/",
+        """Yields current baseurl for photo to download, in the configured download order."""
+        # queue of media not yet downloaded, ordered by the download_order policy
+        queue = utils.scheduler.download_queue(
+            data["media"], policy=config["download_order"]
+        )
+
+        while len(queue) > 0:
+            media = queue.pop()
+            media_data = data["media"][media]
+
+            # base_urls expire after 60 minutes, so generate a new one if it is close to expiring
+            if time() - media_data["last_checked_at"] > 50 * 60:
+                refreshed_data = await client.request(
+                    "mediaItems/" + media, "photoslibrary.readonly"
                 )
-            )
+                media_data["url"] = refreshed_data["baseUrl"]
+                media_data["last_checked_at"] = int(time())
+            # yield the data
+            yield media, media_data
+
+    # post process completed downloads in a process pool, if enabled
+    if config["post_process_downloads"]:
+        processor = utils.postprocess.post_processor(
+            workers=config["post_process_workers"],
+            queue_size=config["post_process_queue_size"],
+            sidecars=config["write_xmp_sidecars"],
         )
-        data["media"][media]["downloaded"] = True
+    else:
+        processor = None
+
+    async def download(media, media_data):
+        """Downloads a media item, and queues it for post processing."""
+        await client.download_file(
+            media_data["filename"],
+            media_data["url"],
+            download_path="output/media/",
+        )
+
+        if processor is not None:
+            await processor.put(
+                media, data["media"][media], "output/media/" + media_data["filename"]
+            )
+
+    # always clean up the post processing consumers and worker processes, even on errors
+    try:
+        download_tasks = []
+        async for media, media_data in current_download_data(data):
+            progress_tracker.next()
+
+            if "video" in media_data["type"]:
+                media_data["url"] += "=dv"
+            else:
+                media_data["url"] += "=d"
+
+            download_tasks.append(asyncio.ensure_future(download(media, media_data)))
+            data["media"][media]["downloaded"] = True
 
-        if len(download_tasks) == config["concurrent_downloads"]:
-            download_tasks = await asyncio.wait(download_tasks)
-            download_tasks = []
+            if len(download_tasks) == config["concurrent_downloads"]:
+                download_tasks = await asyncio.wait(download_tasks)
+                download_tasks = []
 
-    if len(download_tasks) > 0:
-        await asyncio.wait(download_tasks)
+        if len(download_tasks) > 0:
+            await asyncio.wait(download_tasks)
 
-    progress_tracker.finish("Finished downloading media.")
+        progress_tracker.finish("Finished downloading media.")
+    finally:
+        # wait for post processing to finish, and record its metrics
+        if processor is not None:
+            await processor.close()
+            data["stats"]["post_processing"] = processor.stats()
 
     # switch to progress spinner's ending message
     return data
@@ -182,92 +228,73 @@ async def fetch_library(client, data: dict) -> dict:
     # progress spinner
     progress_tracker = utils.progress.spinner("Fetching media... ")
 
-    # emtpy dict for data google will send back
-    response_data = {"nextPageToken": ""}
-
-    # next page pagation token
-    next_page = ""
-
-    # begin pagation
-    while "nextPageToken" in response_data:
-        # pageSize is 100 to maximize efficiency; includeArchivedMedia is enabled because by default it is false
-        request_data = {"pageSize": 100, "filters": {"includeArchivedMedia": True}}
-
-        if bool(
-            next_page
-        ):  # if not first run, apply page token (bool() is used rather than len() > 0)
-            request_data["pageToken"] = next_page
+    # page through date-range partitions of the library concurrently
+    lister = utils.lister.partitioned_lister(
+        client,
+        concurrency=config["concurrent_listings"],
+        on_page=progress_tracker.next,  # tick progress tracker
+    )
+    media = await lister.fetch()
 
-        # gather new page key from last runthrough of page
-        next_page = response_data["nextPageToken"]
+    for entry in media.values():
+        # convert timestring to timestamp
+        entry["mediaMetadata"]["creationTime"] = datetime.parse_datetime(
+            entry["mediaMetadata"]["creationTime"]
+        )
 
-        # request google photos data from google
-        response_data = await client.request(
-            "mediaItems:search",
-            "photoslibrary.readonly",
-            method="post",
-            data=request_data,
+        # (google's timestrings are UTC, so read the time tuple as UTC rather than local time)
+        entry["mediaMetadata"]["creationTime"] = timegm(
+            entry["mediaMetadata"]["creationTime"].utctimetuple()
         )
 
-        if "mediaItems" in response_data:
-            for entry in response_data["mediaItems"]:
-                # convert timestring to timestamp
-                entry["mediaMetadata"]["creationTime"] = datetime.parse_datetime(
-                    entry["mediaMetadata"]["creationTime"]
-                )
+        # convert size values to integers
+        if ("height" in entry["mediaMetadata"]) and ("width" in entry["mediaMetadata"]):
+            entry["mediaMetadata"]["width"] = int(entry["mediaMetadata"]["width"])
+            entry["mediaMetadata"]["height"] = int(entry["mediaMetadata"]["height"])
 
-                entry["mediaMetadata"]["creationTime"] = int(
-                    mktime(entry["mediaMetadata"]["creationTime"].timetuple())
-                )
+        # set video status to bool
+        if "video" in entry["mediaMetadata"]:
+            try:
+                entry["mediaMetadata"]["video"]["status"] = (
+                    entry["mediaMetadata"]["video"]["status"] == "READY"
+                )  # change status to bool
+                entry["mediaMetadata"]["video"]["fps"] = round(
+                    entry["mediaMetadata"]["video"]["fps"], 2
+                )  # round fps
+            except KeyError:
+                entry["mediaMetadata"]["video"][
+                    "status"
+                ] = None  # otherwise set status to null
+
+        # flag as downloaded if already flagged as downloaded, otherwise flag as not downloaded
+        if (entry["id"] in data["media"]) and (
+            "downloaded" in data["media"][entry["id"]]
+        ):
+            downloaded = data["media"][entry["id"]]["downloaded"]
+        else:
+            downloaded = False
 
-                # convert size values to integers
-                if ("height" in entry["mediaMetadata"]) and (
-                    "width" in entry["mediaMetadata"]
-                ):
-                    entry["mediaMetadata"]["width"] = int(
-                        entry["mediaMetadata"]["width"]
-                    )
-                    entry["mediaMetadata"]["height"] = int(
-                        entry["mediaMetadata"]["height"]
-                    )
-
-                # set video status to bool
-                if "video" in entry["mediaMetadata"]:
-                    try:
-                        entry["mediaMetadata"]["video"]["status"] = (
-                            entry["mediaMetadata"]["video"]["status"] == "READY"
-                        )  # change status to bool
-                        entry["mediaMetadata"]["video"]["fps"] = round(
-                            entry["mediaMetadata"]["video"]["fps"], 2
-                        )  # round fps
-                    except KeyError:
-                        entry["mediaMetadata"]["video"][
-                            "status"
-                        ] = None  # otherwise set status to null
-
-                # flag as downloaded if already flagged as downloaded, otherwise flag as not downloaded
-                if (entry["id"] in data) and (
-                    "downloaded" in data["media"][entry["id"]]
-                ):
-                    downloaded = data["media"][entry["id"]]["downloaded"]
-                else:
-                    downloaded = False
-
-                # split mimetype to array
-                entry["mimeType"] = entry["mimeType"].split("/")
-
-                # only keep needed data when dumping to output
-                data["media"][entry["id"]] = {
-                    "url": entry["baseUrl"],
-                    "filename": sanitize(entry["id"] + "." + entry["mimeType"][1]),
-                    "type": entry["mimeType"][0],
-                    "extension": entry["mimeType"][1],
-                    "metadata": entry["mediaMetadata"],
-                    "last_checked_at": int(time()),
-                    "downloaded": downloaded,
-                }
-
-        progress_tracker.next()  # tick progress tracker
+        # keep the checksum from post processing, since downloaded media isn't processed again
+        if entry["id"] in data["media"]:
+            checksum = data["media"][entry["id"]].get("checksum")
+        else:
+            checksum = None
+
+        # split mimetype to array
+        entry["mimeType"] = entry["mimeType"].split("/")
+
+        # only keep needed data when dumping to output
+        data["media"][entry["id"]] = {
+            "url": entry["baseUrl"],
+            "filename": sanitize(entry["id"] + "." + entry["mimeType"][1]),
+            "type": entry["mimeType"][0],
+            "extension": entry["mimeType"][1],
+            "metadata": entry["mediaMetadata"],
+            "last_checked_at": int(time()),
+            "downloaded": downloaded,
+        }
+        if checksum is not None:
+            data["media"][entry["id"]]["checksum"] = checksum
 
     # switch to progress spinner's ending message
     progress_tracker.finish("Finished fetching media")
@@ -289,11 +316,15 @@ async def fetch_library(client, data: dict) -> dict:
 
 
 # run main script every specified interval (in hours)
-lapse = 1
-while True:
-    asyncio.run(load_data(lapse))
-    lapse += 1
-    print(
-        "\nWaiting " + str(config["scan_library_interval"]) + " hours until next lapse."
-    )
-    sleep(config["scan_library_interval"] * 60 * 60)
+# (guarded so post processing worker processes don't start their own lapses when importing main)
+if __name__ == "__main__":
+    lapse = 1
+    while True:
+        asyncio.run(load_data(lapse))
+        lapse += 1
+        print(
+            "\nWaiting "
+            + str(config["scan_library_interval"])
+            + " hours until next lapse."
+        )
+        sleep(config["scan_library_interval"] * 60 * 60)
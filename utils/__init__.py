@@ -1,4 +1,7 @@
 from utils.google import main as google
 import utils.progress
+import utils.lister
+import utils.postprocess
+import utils.scheduler
 import os
 import json
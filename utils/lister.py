@@ -0,0 +1,228 @@
+import asyncio
+from datetime import date, timedelta
+
+# earliest creation date searched for when listing the library
+EARLIEST_DATE = date(1900, 1, 1)
+
+
+class partitioned_lister:
+    """
+    Class to list an entire google photos library by paging date-range partitions concurrently
+
+    Page tokens can only be followed one after another, so the library's time span is split into
+    date ranges which are each paged by their own worker. Pages are requested newest first, so when a
+    partition turns out to need more pages and there are idle workers, only the part older than what
+    has already been seen is split in half and handed to the idle workers.
+
+    Attributes:
+        client: google_api client object
+        concurrency: number of partitions to page at once
+        media: dict of every media item found, keyed by media id (deduplicated)
+        requests: number of search requests made so far
+    """
+
+    def __init__(self, client, concurrency=8, on_page=None) -> None:
+        """
+        Store the client and listing options.
+
+        Args:
+            client: google_api client object
+            concurrency: number of partitions to page at once
+            on_page: function called after every page is fetched (for ticking progress trackers)
+        Returns:
+            None
+        """
+
+        self.client = client
+        self.concurrency = concurrency
+        self.on_page = on_page
+
+        self.media = {}  # found media items keyed by id
+        self.requests = 0  # search requests made so far
+        self.idle = 0  # workers waiting for a partition
+
+    def split(self, start: date, end: date, parts: int) -> list:
+        """
+        Split an inclusive date range into (at most) a number of consecutive inclusive ranges
+
+        Args:
+            start: first day of the range
+            end: last day of the range
+            parts: number of ranges to split into
+        Returns:
+            list of (start, end) tuples
+        """
+
+        days = (end - start).days + 1
+        parts = max(1, min(parts, days))
+
+        ranges = []
+        for part in range(parts):
+            range_start = start + timedelta(days=days * part // parts)
+            range_end = start + timedelta(days=days * (part + 1) // parts - 1)
+            ranges.append((range_start, range_end))
+
+        return ranges
+
+    @staticmethod
+    def creation_date(entry: dict) -> date:
+        """
+        Get the day a media item was created on from google's creationTime timestring
+        """
+        return date.fromisoformat(entry["mediaMetadata"]["creationTime"][:10])
+
+    @staticmethod
+    def date_dict(day: date) -> dict:
+        """
+        Convert a date to the dict format google's dateFilter expects
+        """
+        return {"year": day.year, "month": day.month, "day": day.day}
+
+    async def page(
+        self, start: date, end: date, page_token="", newest_first=True, page_size=100
+    ) -> dict:
+        """
+        Request a single page of media items created within a date range
+
+        Args:
+            start: first day of the range
+            end: last day of the range
+            page_token: pagation token for the page (empty for the first page)
+            newest_first: order by creation time, newest first (otherwise oldest first)
+            page_size: number of media items to request (100 is the most google allows)
+        Returns:
+            response dict
+        """
+
+        # pageSize is 100 to maximize efficiency; includeArchivedMedia is enabled because by default it is false
+        request_data = {
+            "pageSize": page_size,
+            "orderBy": "MediaMetadata.creation_time"
+            + (" desc" if newest_first else ""),
+            "filters": {
+                "includeArchivedMedia": True,
+                "dateFilter": {
+                    "ranges": [
+                        {
+                            "startDate": self.date_dict(start),
+                            "endDate": self.date_dict(end),
+                        }
+                    ]
+                },
+            },
+        }
+
+        if bool(page_token):
+            request_data["pageToken"] = page_token
+
+        self.requests += 1
+        response_data = await self.client.request(
+            "mediaItems:search",
+            "photoslibrary.readonly",
+            method="post",
+            data=request_data,
+        )
+
+        if self.on_page is not None:
+            self.on_page()
+
+        return response_data
+
+    async def worker(self, partitions: asyncio.Queue) -> None:
+        """
+        Page through partitions from the queue until cancelled
+
+        Args:
+            partitions: queue of (start, end) date ranges left to page
+        """
+
+        while True:
+            self.idle += 1
+            start, end = await partitions.get()
+            self.idle -= 1
+
+            try:
+                page_token = ""
+                while True:
+                    response_data = await self.page(start, end, page_token)
+                    entries = response_data.get("mediaItems", [])
+
+                    # merge and deduplicate by media id
+                    for entry in entries:
+                        self.media[entry["id"]] = entry
+
+                    if ("nextPageToken" not in response_data) or (not entries):
+                        break
+
+                    # pages are newest first, so everything after the oldest day seen has been listed
+                    oldest = self.creation_date(entries[-1])
+
+                    # what is left of it ends on the day after the oldest day seen (padded a day to
+                    # cover every timezone)
+                    remaining_end = oldest + timedelta(days=1)
+
+                    # the partition is dense, so split what is left of it with idle workers (only
+                    # items from the last two days seen will be listed again, and are deduplicated by id)
+                    if self.idle > partitions.qsize() and start < oldest < remaining_end < end:
+                        for partition in self.split(start, remaining_end, 2):
+                            partitions.put_nowait(partition)
+                        break
+
+                    page_token = response_data["nextPageToken"]
+            finally:
+                partitions.task_done()
+
+    async def fetch(self, start=EARLIEST_DATE, end=None) -> dict:
+        """
+        List every media item created within a date range
+
+        The oldest and newest media items are requested first, so that only the library's real
+        time span is partitioned.
+
+        Args:
+            start: first day to list media from
+            end: last day to list media from (defaults to tomorrow, to cover every timezone)
+        Returns:
+            dict of media items keyed by media id, as returned by google
+        """
+
+        if end is None:
+            end = date.today() + timedelta(days=1)
+
+        # find the newest and oldest media items (an empty library has neither)
+        newest = await self.page(start, end, page_size=1)
+        if not newest.get("mediaItems"):
+            return self.media
+        oldest = await self.page(start, end, newest_first=False, page_size=1)
+
+        # narrow the range to the library's time span (padded a day to cover every timezone)
+        start = max(
+            start, self.creation_date(oldest["mediaItems"][0]) - timedelta(days=1)
+        )
+        end = min(end, self.creation_date(newest["mediaItems"][0]) + timedelta(days=1))
+
+        partitions = asyncio.Queue()
+        for partition in self.split(start, end, self.concurrency):
+            partitions.put_nowait(partition)
+
+        workers = [
+            asyncio.ensure_future(self.worker(partitions))
+            for _ in range(self.concurrency)
+        ]
+
+        # wait for every partition to be paged, failing early if a worker raises
+        joined = asyncio.ensure_future(partitions.join())
+        try:
+            await asyncio.wait(
+                [joined, *workers], return_when=asyncio.FIRST_COMPLETED
+            )
+            for worker in workers:
+                if worker.done():
+                    worker.result()
+        finally:
+            joined.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return self.media
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from time import time, strftime, gmtime
+from xml.sax.saxutils import escape
+
+
+def text(value) -> str:
+    """
+    Convert a value to xmp text
+    """
+    return escape(str(value))
+
+
+def rational(value) -> str:
+    """
+    Convert a number (or a google duration string, like "0.008s") to an xmp rational, like "1/125"
+    """
+    value = Fraction(str(value).rstrip("s")).limit_denominator(100000)
+    return str(value.numerator) + "/" + str(value.denominator)
+
+
+def sequence(value) -> str:
+    """
+    Convert a value to an xmp ordered array with a single item
+    """
+    return "<rdf:Seq><rdf:li>" + text(value) + "</rdf:li></rdf:Seq>"
+
+
+# google's photo metadata keys, the xmp tags they are written to, and how to convert them
+XMP_TAGS = {
+    "cameraMake": ("tiff:Make", text),
+    "cameraModel": ("tiff:Model", text),
+    "focalLength": ("exif:FocalLength", rational),
+    "apertureFNumber": ("exif:FNumber", rational),
+    "isoEquivalent": ("exif:ISOSpeedRatings", sequence),
+    "exposureTime": ("exif:ExposureTime", rational),
+}
+
+
+def write_sidecar(path: str, metadata: dict) -> None:
+    """
+    Write an XMP sidecar (<path>.xmp) with the creation time and camera metadata of a media item
+
+    Args:
+        path: path of the downloaded file
+        metadata: normalised mediaMetadata of the media item
+    """
+
+    tags = {}
+    if "creationTime" in metadata:
+        # creationTime is a UTC timestamp, so write it as UTC (marked with Z)
+        created = strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(metadata["creationTime"]))
+        tags["xmp:CreateDate"] = created
+        tags["exif:DateTimeOriginal"] = created
+
+    for key, (tag, convert) in XMP_TAGS.items():
+        if key in metadata.get("photo", {}):
+            try:
+                tags[tag] = convert(metadata["photo"][key])
+            except (ValueError, ZeroDivisionError):
+                pass  # leave out values that can't be expressed in xmp
+
+    properties = "".join(
+        "    <" + tag + ">" + value + "</" + tag + ">\n" for tag, value in tags.items()
+    )
+
+    with open(path + ".xmp", "w") as sidecar:
+        sidecar.write(
+            '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+            + ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+            + '  <rdf:Description rdf:about=""\n'
+            + '    xmlns:xmp="http://ns.adobe.com/xap/1.0/"\n'
+            + '    xmlns:tiff="http://ns.adobe.com/tiff/1.0/"\n'
+            + '    xmlns:exif="http://ns.adobe.com/exif/1.0/">\n'
+            + properties
+            + "  </rdf:Description>\n"
+            + " </rdf:RDF>\n"
+            + "</x:xmpmeta>\n"
+        )
+
+
+def process_file(path: str, metadata: dict, sidecar=False) -> tuple:
+    """
+    Post process a downloaded file (runs in a worker process)
+
+    1) checksum the file
+    2) optionally write an xmp sidecar
+    3) set the file's mtime to its creationTime
+
+    Args:
+        path: path of the downloaded file
+        metadata: normalised mediaMetadata of the media item
+        sidecar: whether to write an xmp sidecar
+    Returns:
+        (sha256 hex digest, size of the file in bytes)
+    """
+
+    checksum = hashlib.sha256()
+    with open(path, "rb") as media:
+        for chunk in iter(lambda: media.read(1024 * 1024), b""):
+            checksum.update(chunk)
+
+    if sidecar:
+        write_sidecar(path, metadata)
+
+    if "creationTime" in metadata:
+        os.utime(path, (metadata["creationTime"], metadata["creationTime"]))
+
+    return checksum.hexdigest(), os.path.getsize(path)
+
+
+class post_processor:
+    """
+    Class for post processing downloaded media in a bounded process pool
+
+    Completed downloads are put on a bounded queue, and consumed by tasks that hand the CPU heavy
+    work to the process pool, so that it never blocks the download event loop.
+
+    Attributes:
+        queue: queue of (media id, media data, path) tuples waiting to be processed
+        processed: number of files processed
+        failed: number of files that failed to process
+        bytes: total size of the files processed
+        busy_time: total time spent processing files (summed over every worker)
+        first_put_at: UNIX time the first download was queued
+        last_done_at: UNIX time the last file finished processing
+        puts: number of downloads queued
+        queue_depth_total: sum of the queue depths sampled on every put (for the average)
+        max_queue_depth: largest queue depth seen
+    """
+
+    def __init__(self, workers=2, queue_size=256, sidecars=False) -> None:
+        """
+        Create the process pool and start the consumer tasks (must be called from within an event loop)
+
+        Args:
+            workers: number of worker processes
+            queue_size: max number of downloads waiting to be processed before put() waits
+            sidecars: whether to write xmp sidecars
+        Returns:
+            None
+        """
+
+        self.sidecars = sidecars
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+        self.processed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.busy_time = 0
+        self.first_put_at = None
+        self.last_done_at = None
+        self.puts = 0
+        self.queue_depth_total = 0
+        self.max_queue_depth = 0
+
+        # one consumer per worker keeps the pool busy without flooding it
+        self.consumers = [
+            asyncio.ensure_future(self.consume()) for _ in range(workers)
+        ]
+
+    async def put(self, media: str, media_data: dict, path: str) -> None:
+        """
+        Queue a completed download to be processed (waits if the queue is full)
+
+        Args:
+            media: media id
+            media_data: entry of data["media"] for the media item (its checksum is stored here)
+            path: path of the downloaded file
+        """
+        if self.first_put_at is None:
+            self.first_put_at = time()
+
+        await self.queue.put((media, media_data, path))
+
+        # sample the queue depth while processing runs
+        self.puts += 1
+        self.queue_depth_total += self.queue.qsize()
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    async def consume(self) -> None:
+        """
+        Process queued downloads in the process pool until cancelled
+        """
+
+        loop = asyncio.get_running_loop()
+        while True:
+            media, media_data, path = await self.queue.get()
+            started = time()
+            try:
+                checksum, size = await loop.run_in_executor(
+                    self.pool,
+                    process_file,
+                    path,
+                    media_data["metadata"],
+                    self.sidecars,
+                )
+                media_data["checksum"] = checksum
+                self.processed += 1
+                self.bytes += size
+            except Exception as error:
+                self.failed += 1
+                print("Failed to post process " + media + ": " + repr(error))
+            finally:
+                self.last_done_at = time()
+                self.busy_time += self.last_done_at - started
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        """
+        Gather queue depth and throughput metrics
+
+        Throughput is measured from the first download being queued to the last file finishing
+        processing, so time spent waiting for downloads to start isn't counted.
+
+        Returns:
+            dict of metrics
+        """
+
+        if self.last_done_at is None:
+            elapsed = 0
+        else:
+            elapsed = self.last_done_at - self.first_put_at
+
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "average_queue_depth": round(self.queue_depth_total / self.puts, 3)
+            if self.puts
+            else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "time_taken": round(elapsed, 3),
+            "busy_time": round(self.busy_time, 3),
+            "files_per_second": round(self.processed / elapsed, 3) if elapsed else 0,
+            "megabytes_per_second": round(self.bytes / 1048576 / elapsed, 3)
+            if elapsed
+            else 0,
+        }
+
+    async def close(self) -> None:
+        """
+        Wait for the queue to drain, then stop the consumers and shut down the process pool
+        """
+
+        await self.queue.join()
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.pool.shutdown()
@@ -0,0 +1,134 @@
+import heapq
+
+# rough multiplier for how much larger a video is than a photo of the same dimensions
+VIDEO_WEIGHT = 100
+
+
+class download_queue:
+    """
+    Class for ordering pending downloads by priority
+
+    Media ids are kept in binary heaps, so building the queue is linear and each pop is logarithmic
+    (no full re-sort of the library is needed on every lapse).
+
+    The "fair" policy strictly alternates between the newest-first and smallest-first heaps, so
+    every other download is the newest item left and the rest are the smallest items left.
+
+    Attributes:
+        policy: the ordering policy ("newest", "smallest" or "fair")
+        media: the media dict the queue was built from (data["media"])
+        heaps: the heaps of (priority, media id) tuples used by the policy
+        popped: media ids that have already been popped (for lazy deletion when using "fair")
+        turn: which heap the next pop of the "fair" policy is taken from
+    """
+
+    policies = ("newest", "smallest", "fair")
+
+    def __init__(self, media: dict, policy="newest") -> None:
+        """
+        Build the heaps for every media item that has not yet been downloaded.
+
+        Args:
+            media: data["media"] in the structure as outputted to data.json
+            policy: "newest" for newest first by creationTime, "smallest" for smallest estimated size first,
+                or "fair" to alternate between the two
+        Returns:
+            None
+        Raises:
+            ValueError: the policy is not one of download_queue.policies
+        """
+
+        if policy not in self.policies:
+            raise ValueError("Unknown download order policy " + str(policy))
+
+        self.policy = policy
+        self.media = media
+        self.heaps = []
+        self.popped = set()
+        self.turn = 0
+
+        if policy in ("newest", "fair"):
+            self.heaps.append(
+                [
+                    (-self.creation_time(media_data), media_id)
+                    for media_id, media_data in media.items()
+                    if not media_data["downloaded"]
+                ]
+            )
+
+        if policy in ("smallest", "fair"):
+            self.heaps.append(
+                [
+                    (self.estimated_size(media_data), media_id)
+                    for media_id, media_data in media.items()
+                    if not media_data["downloaded"]
+                ]
+            )
+
+        # heapify is O(n), unlike sorting
+        for heap in self.heaps:
+            heapq.heapify(heap)
+
+        self.remaining = len(self.heaps[0])
+
+    @staticmethod
+    def creation_time(media_data: dict) -> int:
+        """
+        Get the creationTime timestamp of a media item (0 if it is missing)
+        """
+        return media_data["metadata"].get("creationTime", 0)
+
+    @staticmethod
+    def estimated_size(media_data: dict) -> int:
+        """
+        Estimate the relative download size of a media item from its dimensions and type
+
+        Args:
+            media_data: a single entry of data["media"]
+        Returns:
+            estimated size (only meaningful relative to other items)
+        """
+
+        size = media_data["metadata"].get("width", 0) * media_data["metadata"].get(
+            "height", 0
+        )
+
+        if "video" in media_data["type"]:
+            size *= VIDEO_WEIGHT
+
+        return size
+
+    def __len__(self) -> int:
+        """
+        Number of media items left in the queue
+        """
+        return self.remaining
+
+    def pop(self) -> str:
+        """
+        Pop the id of the next media item to download
+
+        Returns:
+            media id of the highest priority item left
+        Raises:
+            IndexError: the queue is empty
+        """
+
+        if self.remaining == 0:
+            raise IndexError("pop from empty download queue")
+
+        # alternate between heaps for the fair policy
+        heap = self.heaps[self.turn]
+        self.turn = (self.turn + 1) % len(self.heaps)
+
+        # skip over items already popped from the other heap
+        while True:
+            media_id = heapq.heappop(heap)[1]
+            if media_id not in self.popped:
+                break
+
+        if len(self.heaps) > 1:
+            self.popped.add(media_id)
+
+        self.remaining -= 1
+        return media_id